@@ -16,17 +16,15 @@
 # along with VoltDB.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
-if sys.hexversion < 0x02050000:
-    raise Exception("Python version 2.5 or greater is required.")
+if sys.hexversion < 0x02070000:
+    raise Exception("Python version 2.7 or greater is required.")
 import array
+import math
 import socket
 import struct
 import datetime
 import decimal
-try:
-    from hashlib import sha1 as sha
-except ImportError:
-    from sha import sha
+from hashlib import sha1
 
 decimal.getcontext().prec = 38
 
@@ -38,11 +36,14 @@ def isNaN(d):
     if d == None:
         return False
 
-    # work-around for Python 2.4
-    s = array.array("d", [d])
-    return (s.tostring() == "\x00\x00\x00\x00\x00\x00\xf8\x7f" or
-            s.tostring() == "\x00\x00\x00\x00\x00\x00\xf8\xff" or
-            s.tostring() == "\x00\x00\x00\x00\x00\x00\xf0\x7f")
+    return math.isnan(d)
+
+def isNullFloat(d):
+    """FLOAT NULLs are matched approximately: any value within 1e307 of
+    FastSerializer.NULL_FLOAT_INDICATOR is NULL.
+    """
+
+    return abs(d - FastSerializer.NULL_FLOAT_INDICATOR) < 1e307
 
 def if_else(cond, a, b):
     """Work around Python 2.4
@@ -51,6 +52,10 @@ def if_else(cond, a, b):
     if cond: return a
     else: return b
 
+class VoltProtocolError(Exception):
+    "value or type that can't be (de)serialized in the VoltDB wire format"
+    pass
+
 class ReadBuffer(object):
     """
     Read buffer management class.
@@ -62,27 +67,43 @@ class ReadBuffer(object):
         self._buf = ""
         self._off = 0
 
-    def buffer_length(self):
-        return len(self._buf)
-
     def get_buffer(self):
         return self._buf
 
-    def append(self, content):
-        self._buf += content
+    def receive(self, sock, size):
+        """
+        Replaces the buffer content with exactly size bytes from sock.
+        """
+        # Receive straight into a buffer of the final size rather than
+        # concatenating chunks, which would copy the message over and over.
+        buf = bytearray(size)
+        view = memoryview(buf)
+        received = 0
+        while received < size:
+            count = sock.recv_into(view[received:])
+            if count == 0:
+                raise IOError("Connection broken")
+            received += count
+        # Convert once so that the fields read out of it are plain slices
+        self._buf = bytes(buf)
+        self._off = 0
 
     def shift(self, size):
         self._off += size
 
     def read(self, size):
+        if self._off + size > len(self._buf):
+            raise VoltProtocolError("Can't read %d bytes at offset %d of a %d byte message"
+                                    % (size, self._off, len(self._buf)))
         return self._buf[self._off:self._off+size]
 
-    def unpack(self, format, size):
+    def unpack_struct(self, compiled):
         try:
-            values = struct.unpack_from(format, self._buf, self._off)
+            values = compiled.unpack_from(self._buf, self._off)
         except struct.error, e:
-            print 'Exception unpacking %d bytes using format "%s": %s' % (size, format, str(e))
-        self.shift(size)
+            raise VoltProtocolError('Exception unpacking %d bytes using format "%s": %s'
+                                    % (compiled.size, compiled.format, str(e)))
+        self.shift(compiled.size)
         return values
 
 class FastSerializer:
@@ -93,6 +114,15 @@ class FastSerializer:
 
     ARRAY = -99
 
+    # every message is preceded by its 32 bit length
+    LENGTH_PREFIX_SIZE = 4
+
+    # socket send and receive buffer size (bytes)
+    SOCKET_BUFFER_SIZE = 1024 * 1024
+
+    # maximum number of compiled array structs kept
+    ARRAY_STRUCT_CACHE_SIZE = 256
+
     # VoltType enumerations
     VOLTTYPE_NULL = 1
     VOLTTYPE_TINYINT = 3  # int8
@@ -118,17 +148,20 @@ class FastSerializer:
     NULL_BIGINT_INDICATOR = -9223372036854775808
     NULL_FLOAT_INDICATOR = -1.7E308
 
+    # struct format character and NULL indicator of the fixed size numeric
+    # types, used to pack a whole array of them in one call
+    FIXED_ARRAY_FORMAT = {VOLTTYPE_TINYINT: ('b', NULL_TINYINT_INDICATOR),
+                          VOLTTYPE_SMALLINT: ('h', NULL_SMALLINT_INDICATOR),
+                          VOLTTYPE_INTEGER: ('i', NULL_INTEGER_INDICATOR),
+                          VOLTTYPE_BIGINT: ('q', NULL_BIGINT_INDICATOR),
+                          VOLTTYPE_FLOAT: ('d', NULL_FLOAT_INDICATOR)}
+
     # default decimal scale
     DEFAULT_DECIMAL_SCALE = 12
 
     # procedure call result codes
     PROC_OK = 0
 
-    # there are assumptions here about datatype sizes which are
-    # machine dependent. the program exits with an error message
-    # if these assumptions are not true. it is further assumed
-    # that host order is little endian. See isNaN().
-
     def __init__(self, host = None, port = 21212, username = "",
                  password = "", dump_file_path = None,
                  connect_timeout = 8,
@@ -145,7 +178,7 @@ class FastSerializer:
         :param default_timeout: default timeout (secs) or None for all other operations (default=None)
         """
         # connect a socket to host, port and get a file object
-        self.wbuf = array.array('c')
+        self.__resetWriteBuffer()
         self.host = host
         self.port = port
         if not dump_file_path is None:
@@ -160,6 +193,13 @@ class FastSerializer:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.setblocking(1)
             self.socket.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+            # Large tables and result sets are sent as one message, give the
+            # kernel enough room to move them without many small writes. This
+            # has to happen before connecting for the receive window to scale.
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                   self.SOCKET_BUFFER_SIZE)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                   self.SOCKET_BUFFER_SIZE)
             self.socket.connect((self.host, self.port))
 
         # input can be big or little endian
@@ -221,8 +261,7 @@ class FastSerializer:
                                       None, x),
                           self.VOLTTYPE_FLOAT:
                               lambda x:
-                              if_else(abs(x - self.__class__.NULL_FLOAT_INDICATOR) < 1e307,
-                                      None, x),
+                              if_else(isNullFloat(x), None, x),
                           self.VOLTTYPE_STRING:
                               lambda x:
                               if_else(x == self.__class__.NULL_STRING_INDICATOR,
@@ -247,16 +286,33 @@ class FastSerializer:
             self.socket.settimeout(self.default_timeout)
 
     def __compileStructs(self):
-        # Compiled structs for each type
-        self.byteType = lambda length : '%c%db' % (self.inputBOM, length)
-        self.ubyteType = lambda length : '%c%dB' % (self.inputBOM, length)
-        self.int16Type = lambda length : '%c%dh' % (self.inputBOM, length)
-        self.int32Type = lambda length : '%c%di' % (self.inputBOM, length)
-        self.int64Type = lambda length : '%c%dq' % (self.inputBOM, length)
-        self.uint64Type = lambda length : '%c%dQ' % (self.inputBOM, length)
-        self.float64Type = lambda length : '%c%dd' % (self.inputBOM, length)
-        self.stringType = lambda length : '%c%ds' % (self.inputBOM, length)
-        self.varbinaryType = lambda length : '%c%ds' % (self.inputBOM, length)
+        # Precompiled structs for single value reads and writes
+        self.byteStruct = struct.Struct(self.inputBOM + 'b')
+        self.int16Struct = struct.Struct(self.inputBOM + 'h')
+        self.int32Struct = struct.Struct(self.inputBOM + 'i')
+        self.int64Struct = struct.Struct(self.inputBOM + 'q')
+        self.float64Struct = struct.Struct(self.inputBOM + 'd')
+        # decimals are always sent as 16 big-endian bytes
+        self.decimalStruct = struct.Struct('>QQ')
+
+        # Fixed parts of the authentication and invocation messages:
+        # version byte + string length, client handle + parameter count
+        self.versionAndLengthStruct = struct.Struct(self.inputBOM + 'bi')
+        self.handleAndCountStruct = struct.Struct(self.inputBOM + 'qh')
+
+        # Structs for arrays, compiled on demand by __arrayStruct()
+        self.__arrayStructs = {}
+
+    def __arrayStruct(self, format, cnt):
+        key = (format, cnt)
+        compiled = self.__arrayStructs.get(key)
+        if compiled is None:
+            # arrays come in many lengths, don't let the cache grow unbounded
+            if len(self.__arrayStructs) >= self.ARRAY_STRUCT_CACHE_SIZE:
+                self.__arrayStructs.clear()
+            compiled = struct.Struct('%c%d%c' % (self.inputBOM, cnt, format))
+            self.__arrayStructs[key] = compiled
+        return compiled
 
     def close(self):
         if self.dump_file != None:
@@ -267,11 +323,10 @@ class FastSerializer:
         # Requires sending a length preceded username and password even if
         # authentication is turned off.
 
-        #protocol version
-        self.writeByte(0)
-
-        # service requested
-        self.writeString("database")
+        #protocol version and service requested
+        service = "database"
+        self.wbuf.extend(self.versionAndLengthStruct.pack(0, len(service)))
+        self.wbuf.extend(service)
 
         if username:
             # utf8 encode supplied username
@@ -281,10 +336,9 @@ class FastSerializer:
             self.writeString("")
 
         # password supplied, sha-1 hash it
-        m = sha()
-        m.update(password)
-        pwHash = m.digest()
-        self.wbuf.extend(pwHash)
+        if isinstance(password, unicode):
+            password = password.encode("utf-8")
+        self.wbuf.extend(sha1(password).digest())
 
         self.prependLength()
         self.flush()
@@ -308,8 +362,7 @@ class FastSerializer:
         self.readInt64()
         self.readInt64()
         self.readInt32()
-        for x in range(self.readInt32()):
-            self.readByte()
+        self.readRaw(self.readInt32())
 
     def setInputByteOrder(self, bom):
         # assuming bom is high bit set?
@@ -321,69 +374,75 @@ class FastSerializer:
         # recompile the structs
         self.__compileStructs()
 
+    def __resetWriteBuffer(self):
+        # The first 4 bytes of the write buffer are reserved for the message
+        # length so that prependLength() can fill it in place.
+        self.wbuf = bytearray(self.LENGTH_PREFIX_SIZE)
+
     def prependLength(self):
         # write 32 bit array length at offset 0, NOT including the
         # size of this length preceding value. This value is written
         # in the network order.
-        ttllen = self.wbuf.buffer_info()[1] * self.wbuf.itemsize
-        lenBytes = struct.pack(self.inputBOM + 'i', ttllen)
-        map(lambda x: self.wbuf.insert(0, x), lenBytes[::-1])
+        self.int32Struct.pack_into(self.wbuf, 0,
+                                   len(self.wbuf) - self.LENGTH_PREFIX_SIZE)
 
     def size(self):
-        """Returns the size of the write buffer.
+        """Returns the size of the write buffer, not including the reserved
+        length prefix.
         """
 
-        return (self.wbuf.buffer_info()[1] * self.wbuf.itemsize)
+        return len(self.wbuf) - self.LENGTH_PREFIX_SIZE
 
     def flush(self):
         if self.socket is None:
-            print "ERROR: not connected to server."
-            exit(-1)
+            raise IOError("Not connected to server.")
 
         if self.dump_file != None:
             self.dump_file.write(self.wbuf)
             self.dump_file.write("\n")
-        self.socket.sendall(self.wbuf.tostring())
-        self.wbuf = array.array('c')
+        self.socket.sendall(bytes(self.wbuf))
+        self.__resetWriteBuffer()
 
     def bufferForRead(self):
         if self.socket is None:
-            print "ERROR: not connected to server."
-            exit(-1)
+            raise IOError("Not connected to server.")
 
         # fully buffer a new length preceded message from socket
         # read the length. the read until the buffer is completed.
-        responseprefix = ""
-        while (len(responseprefix) < 4):
-            responseprefix += self.socket.recv(4 - len(responseprefix))
-            if responseprefix == "":
-                raise IOError("Connection broken")
+        self.read_buffer.receive(self.socket, self.LENGTH_PREFIX_SIZE)
         if self.dump_file != None:
-            self.dump_file.write(responseprefix)
-        responseLength = struct.unpack(self.int32Type(1), responseprefix)[0]
-        self.read_buffer.clear()
-        remaining = responseLength
-        while remaining > 0:
-            message = self.socket.recv(remaining)
-            self.read_buffer.append(message)
-            remaining = responseLength - self.read_buffer.buffer_length()
+            self.dump_file.write(self.read_buffer.get_buffer())
+        responseLength = self.read_buffer.unpack_struct(self.int32Struct)[0]
+        self.read_buffer.receive(self.socket, responseLength)
         if not self.dump_file is None:
             self.dump_file.write(self.read_buffer.get_buffer())
             self.dump_file.write("\n")
 
     def read(self, type):
+        return self.getReader(type)()
+
+    def write(self, type, value):
+        return self.getWriter(type)(value)
+
+    def getReader(self, type):
+        """Returns the reader function for the given wire type, for callers
+        that read many values of the same type.
+        """
+
         if type not in self.READER:
-            print "ERROR: can't read wire type(", type, ") yet."
-            exit(-2)
+            raise VoltProtocolError("Can't read wire type (%r) yet." % (type,))
 
-        return self.READER[type]()
+        return self.READER[type]
+
+    def getWriter(self, type):
+        """Returns the writer function for the given wire type, for callers
+        that write many values of the same type.
+        """
 
-    def write(self, type, value):
         if type not in self.WRITER:
-            print "ERROR: can't write wire type(", type, ") yet."
-            exit(-2)
+            raise VoltProtocolError("Can't write wire type (%r) yet." % (type,))
 
-        return self.WRITER[type](value)
+        return self.WRITER[type]
 
     def readWireType(self):
         type = self.readByte()
@@ -391,14 +450,13 @@ class FastSerializer:
 
     def writeWireType(self, type, value):
         if type not in self.WRITER:
-            print "ERROR: can't write wire type(", type, ") yet."
-            exit(-2)
+            raise VoltProtocolError("Can't write wire type (%r) yet." % (type,))
 
         self.writeByte(type)
         return self.write(type, value)
 
     def getRawBytes(self):
-        return self.wbuf
+        return self.wbuf[self.LENGTH_PREFIX_SIZE:]
 
     def writeRawBytes(self, value):
         """Appends the given raw bytes to the end of the write buffer.
@@ -411,11 +469,18 @@ class FastSerializer:
 
     def readArray(self, type):
         if type not in self.ARRAY_READER:
-            print "ERROR: can't read wire type(", type, ") yet."
-            exit(-2)
+            raise VoltProtocolError("Can't read wire type (%r) yet." % (type,))
 
         return self.ARRAY_READER[type]()
 
+    def readRaw(self, cnt):
+        """Returns the next cnt bytes of the read buffer unchanged.
+        """
+
+        val = self.read_buffer.read(cnt)
+        self.read_buffer.shift(cnt)
+        return val
+
     def readNull(self):
         return None
 
@@ -427,8 +492,7 @@ class FastSerializer:
             return
 
         if type not in self.ARRAY_READER:
-            print "ERROR: Unsupported date type (", type, ")."
-            exit(-2)
+            raise VoltProtocolError("Unsupported data type (%r)." % (type,))
 
         # serialize arrays of bytes as larger values to support
         # strings and varbinary input
@@ -437,55 +501,89 @@ class FastSerializer:
         else:
             self.writeInt32(len(array))
 
+        if type in self.FIXED_ARRAY_FORMAT:
+            (format, null) = self.FIXED_ARRAY_FORMAT[type]
+            values = [null if i is None else i for i in array]
+            self.wbuf.extend(self.__arrayStruct(format, len(values)).pack(*values))
+            return
+
         for i in array:
             self.WRITER[type](i)
 
     def writeWireTypeArray(self, type, array):
         if type not in self.ARRAY_READER:
-            print "ERROR: can't write wire type(", type, ") yet."
-            exit(-2)
+            raise VoltProtocolError("Can't write wire type (%r) yet." % (type,))
 
         self.writeByte(type)
         self.writeArray(type, array)
 
+    def readFixedSizeRows(self, types, count):
+        """Reads count length preceded table rows whose column types are all
+        in FIXED_ARRAY_FORMAT, decoding each row with a single struct call.
+        """
+
+        formats = [self.FIXED_ARRAY_FORMAT[type] for type in types]
+        rowStruct = struct.Struct(self.inputBOM + 'i' +
+                                  ''.join([format for (format, null) in formats]))
+        # FLOAT NULLs are matched approximately by isNullFloat() instead of
+        # comparing against the indicator
+        floats = [j for j in xrange(len(types))
+                  if types[j] == self.VOLTTYPE_FLOAT]
+        nulls = [null for (format, null) in formats]
+        for j in floats:
+            nulls[j] = None
+        columns = range(1, len(types) + 1)
+
+        unpack = self.read_buffer.unpack_struct
+        rows = []
+        for i in xrange(count):
+            # the first value is the row size
+            values = unpack(rowStruct)
+            row = [None if values[j] == nulls[j - 1] else values[j]
+                   for j in columns]
+            for j in floats:
+                if isNullFloat(row[j]):
+                    row[j] = None
+            rows.append(row)
+        return rows
+
     # byte
     def readByteArrayContent(self, cnt):
-        offset = cnt * struct.calcsize('b')
-        return self.read_buffer.unpack(self.byteType(cnt), offset)
+        return self.read_buffer.unpack_struct(self.__arrayStruct('b', cnt))
 
     def readByteArray(self):
         length = self.readInt32()
         val = self.readByteArrayContent(length)
-        val = map(self.NullCheck[self.VOLTTYPE_TINYINT], val)
-        return val
+        # substitute NULLs in one pass instead of a NullCheck call per element
+        null = self.__class__.NULL_TINYINT_INDICATOR
+        return [None if v == null else v for v in val]
 
     def readByte(self):
-        val = self.readByteArrayContent(1)[0]
+        val = self.read_buffer.unpack_struct(self.byteStruct)[0]
         return self.NullCheck[self.VOLTTYPE_TINYINT](val)
 
     def readByteRaw(self):
-        return self.readByteArrayContent(1)[0]
+        return self.read_buffer.unpack_struct(self.byteStruct)[0]
 
     def writeByte(self, value):
         if value == None:
             val = self.__class__.NULL_TINYINT_INDICATOR
         else:
             val = value
-        self.wbuf.extend(struct.pack(self.byteType(1), val))
+        self.wbuf.extend(self.byteStruct.pack(val))
 
     # int16
     def readInt16ArrayContent(self, cnt):
-        offset = cnt * struct.calcsize('h')
-        return self.read_buffer.unpack(self.int16Type(cnt), offset)
+        return self.read_buffer.unpack_struct(self.__arrayStruct('h', cnt))
 
     def readInt16Array(self):
         length = self.readInt16()
         val = self.readInt16ArrayContent(length)
-        val = map(self.NullCheck[self.VOLTTYPE_SMALLINT], val)
-        return val
+        null = self.__class__.NULL_SMALLINT_INDICATOR
+        return [None if v == null else v for v in val]
 
     def readInt16(self):
-        val = self.readInt16ArrayContent(1)[0]
+        val = self.read_buffer.unpack_struct(self.int16Struct)[0]
         return self.NullCheck[self.VOLTTYPE_SMALLINT](val)
 
     def writeInt16(self, value):
@@ -493,21 +591,20 @@ class FastSerializer:
             val = self.__class__.NULL_SMALLINT_INDICATOR
         else:
             val = value
-        self.wbuf.extend(struct.pack(self.int16Type(1), val))
+        self.wbuf.extend(self.int16Struct.pack(val))
 
     # int32
     def readInt32ArrayContent(self, cnt):
-        offset = cnt * struct.calcsize('i')
-        return self.read_buffer.unpack(self.int32Type(cnt), offset)
+        return self.read_buffer.unpack_struct(self.__arrayStruct('i', cnt))
 
     def readInt32Array(self):
         length = self.readInt16()
         val = self.readInt32ArrayContent(length)
-        val = map(self.NullCheck[self.VOLTTYPE_INTEGER], val)
-        return val
+        null = self.__class__.NULL_INTEGER_INDICATOR
+        return [None if v == null else v for v in val]
 
     def readInt32(self):
-        val = self.readInt32ArrayContent(1)[0]
+        val = self.read_buffer.unpack_struct(self.int32Struct)[0]
         return self.NullCheck[self.VOLTTYPE_INTEGER](val)
 
     def writeInt32(self, value):
@@ -515,21 +612,20 @@ class FastSerializer:
             val = self.__class__.NULL_INTEGER_INDICATOR
         else:
             val = value
-        self.wbuf.extend(struct.pack(self.int32Type(1), val))
+        self.wbuf.extend(self.int32Struct.pack(val))
 
     # int64
     def readInt64ArrayContent(self, cnt):
-        offset = cnt * struct.calcsize('q')
-        return self.read_buffer.unpack(self.int64Type(cnt), offset)
+        return self.read_buffer.unpack_struct(self.__arrayStruct('q', cnt))
 
     def readInt64Array(self):
         length = self.readInt16()
         val = self.readInt64ArrayContent(length)
-        val = map(self.NullCheck[self.VOLTTYPE_BIGINT], val)
-        return val
+        null = self.__class__.NULL_BIGINT_INDICATOR
+        return [None if v == null else v for v in val]
 
     def readInt64(self):
-        val = self.readInt64ArrayContent(1)[0]
+        val = self.read_buffer.unpack_struct(self.int64Struct)[0]
         return self.NullCheck[self.VOLTTYPE_BIGINT](val)
 
     def writeInt64(self, value):
@@ -537,21 +633,19 @@ class FastSerializer:
             val = self.__class__.NULL_BIGINT_INDICATOR
         else:
             val = value
-        self.wbuf.extend(struct.pack(self.int64Type(1), val))
+        self.wbuf.extend(self.int64Struct.pack(val))
 
     # float64
     def readFloat64ArrayContent(self, cnt):
-        offset = cnt * struct.calcsize('d')
-        return self.read_buffer.unpack(self.float64Type(cnt), offset)
+        return self.read_buffer.unpack_struct(self.__arrayStruct('d', cnt))
 
     def readFloat64Array(self):
         length = self.readInt16()
         val = self.readFloat64ArrayContent(length)
-        val = map(self.NullCheck[self.VOLTTYPE_FLOAT], val)
-        return val
+        return [None if isNullFloat(v) else v for v in val]
 
     def readFloat64(self):
-        val = self.readFloat64ArrayContent(1)[0]
+        val = self.read_buffer.unpack_struct(self.float64Struct)[0]
         return self.NullCheck[self.VOLTTYPE_FLOAT](val)
 
     def writeFloat64(self, value):
@@ -559,20 +653,14 @@ class FastSerializer:
             val = self.__class__.NULL_FLOAT_INDICATOR
         else:
             val = value
-        # work-around for python 2.4
-        tmp = array.array("d", [val])
-        if self.inputBOM != self.localBOM:
-            tmp.byteswap()
-        self.wbuf.extend(tmp.tostring())
+        self.wbuf.extend(self.float64Struct.pack(val))
 
     # string
     def readStringContent(self, cnt):
         if cnt == 0:
             return ""
 
-        offset = cnt * struct.calcsize('c')
-        val = self.read_buffer.unpack(self.stringType(cnt), offset)
-        return val[0].decode("utf-8")
+        return self.readRaw(cnt).decode("utf-8")
 
     def readString(self):
         # length preceeded (4 byte value) string
@@ -592,11 +680,11 @@ class FastSerializer:
 
     def writeString(self, value):
         if value is None:
-            self.writeInt32(self.NULL_STRING_INDICATOR)
+            self.wbuf.extend(self.int32Struct.pack(self.NULL_STRING_INDICATOR))
             return
 
         encoded_value = value.encode("utf-8")
-        self.writeInt32(len(encoded_value))
+        self.wbuf.extend(self.int32Struct.pack(len(encoded_value)))
         self.wbuf.extend(encoded_value)
 
     # varbinary
@@ -604,10 +692,7 @@ class FastSerializer:
         if cnt == 0:
             return array.array('c', [])
 
-        offset = cnt * struct.calcsize('c')
-        val = self.read_buffer.unpack(self.varbinaryType(cnt), offset)
-
-        return array.array('c', val[0])
+        return array.array('c', self.readRaw(cnt))
 
     def readVarbinary(self):
         # length preceeded (4 byte value) string
@@ -618,10 +703,10 @@ class FastSerializer:
 
     def writeVarbinary(self, value):
         if value is None:
-            self.writeInt32(self.NULL_STRING_INDICATOR)
+            self.wbuf.extend(self.int32Struct.pack(self.NULL_STRING_INDICATOR))
             return
 
-        self.writeInt32(len(value))
+        self.wbuf.extend(self.int32Struct.pack(len(value)))
         self.wbuf.extend(value)
 
     # date
@@ -653,25 +738,20 @@ class FastSerializer:
         else:
             seconds = int(value.strftime("%s"))
             val = seconds * 1000000 + value.microsecond
-        self.wbuf.extend(struct.pack(self.int64Type(1), val))
+        self.wbuf.extend(self.int64Struct.pack(val))
 
     def readDecimal(self):
-        offset = 16 * struct.calcsize('b')
-        if self.NullCheck[self.VOLTTYPE_DECIMAL](self.read_buffer.read(offset)) == None:
-            self.read_buffer.shift(offset)
+        if self.NullCheck[self.VOLTTYPE_DECIMAL](self.read_buffer.read(16)) == None:
+            self.read_buffer.shift(16)
             return None
-        val = list(self.read_buffer.unpack(self.ubyteType(16), offset))
-        mostSignificantBit = 1 << 7
-        isNegative = (val[0] & mostSignificantBit) != 0
-        unscaledValue = -(val[0] & mostSignificantBit) << 120
-        # Clear the highest bit
-        # Unleash the powers of the butterfly
-        val[0] &= ~mostSignificantBit
+        (high, low) = self.read_buffer.unpack_struct(self.decimalStruct)
+        isNegative = (high >> 63) != 0
+        unscaledValue = (high << 64) | low
         # Get the 2's complement
-        for x in xrange(16):
-            unscaledValue += val[x] << ((15 - x) * 8)
-        unscaledValue = map(lambda x: int(x), str(abs(unscaledValue)))
-        return decimal.Decimal((isNegative, tuple(unscaledValue),
+        if isNegative:
+            unscaledValue -= 1 << 128
+        return decimal.Decimal((isNegative,
+                                tuple(map(int, str(abs(unscaledValue)))),
                                 -self.__class__.DEFAULT_DECIMAL_SCALE))
 
     def readDecimalArray(self):
@@ -682,31 +762,13 @@ class FastSerializer:
         return tuple(retval)
 
     def __intToBytes(self, value, sign):
-        value_bytes = ""
         if sign == 1:
-            value = ~value + 1      # 2's complement
-        # Turn into byte array
-        while value != 0 and value != -1:
-            byte = value & 0xff
-            # flip the high order bits to 1 only if the number is negative and
-            # this is the highest order byte
-            if value >> 8 == 0 and sign == 1:
-                mask = 1 << 7
-                while mask > 0 and (byte & mask) == 0:
-                    byte |= mask
-                    mask >> 1
-            value_bytes = struct.pack(self.ubyteType(1), byte) + value_bytes
-            value = value >> 8
-        if len(value_bytes) > 16:
+            value = -value
+        if not -(1 << 127) <= value < (1 << 127):
             raise ValueError("Precision of this decimal is >38 digits");
-        if sign == 1:
-            ret = struct.pack(self.ubyteType(1), 0xff)
-        else:
-            ret = struct.pack(self.ubyteType(1), 0)
-        # Pad it
-        ret *= 16 - len(value_bytes)
-        ret += value_bytes
-        return ret
+        # 16 byte 2's complement, written as two 64 bit words
+        value &= (1 << 128) - 1
+        return self.decimalStruct.pack(value >> 64, value & ((1 << 64) - 1))
 
     def writeDecimal(self, num):
         if num is None:
@@ -742,8 +804,10 @@ class FastSerializer:
         # money-unit * 10,000
         return self.readInt64()
 
-class VoltColumn:
+class VoltColumn(object):
     "definition of one VoltDB table column"
+    __slots__ = ("type", "name")
+
     def __init__(self, fser = None, type = None, name = None):
         if fser != None:
             self.type = fser.readByte()
@@ -766,6 +830,16 @@ class VoltColumn:
             return True
         return (self.type == other.type and self.name == other.name)
 
+    # __slots__ classes need these to be picklable with protocols 0 and 1
+    def __getstate__(self):
+        return (self.type, self.name)
+
+    def __setstate__(self, state):
+        # columns pickled before __slots__ carry their instance dict
+        if isinstance(state, dict):
+            state = (state.get("type"), state.get("name"))
+        self.type, self.name = state
+
     def readName(self, fser):
         self.name = fser.readString()
 
@@ -828,50 +902,66 @@ class VoltTable:
         headersize = self.fser.readInt32()
         statuscode = self.fser.readByte()
         columncount = self.fser.readInt16()
-        for i in xrange(columncount):
-            column = VoltColumn(fser = self.fser)
+        # the column types are one contiguous run of bytes, read them at once
+        for type in self.fser.readByteArrayContent(columncount):
+            column = VoltColumn()
+            column.type = type
             self.columns.append(column)
-        map(lambda x: x.readName(self.fser), self.columns)
+        for column in self.columns:
+            column.readName(self.fser)
 
         # 3.
+        types = [column.type for column in self.columns]
         rowcount = self.fser.readInt32()
+        if all([type in FastSerializer.FIXED_ARRAY_FORMAT for type in types]):
+            # every column is a fixed size number, decode whole rows at once
+            self.tuples.extend(self.fser.readFixedSizeRows(types, rowcount))
+            return self
+
+        readers = [self.fser.getReader(type) for type in types]
         for i in xrange(rowcount):
             rowsize = self.fser.readInt32()
-            # list comprehension: build list by calling read for each column in
-            # row/tuple
-            row = [self.fser.read(self.columns[j].type)
-                   for j in xrange(columncount)]
+            # list comprehension: build list by calling the column's reader
+            # for each column in row/tuple
+            row = [read() for read in readers]
             self.tuples.append(row)
 
         return self
 
     def writeToSerializer(self):
-        table_fser = FastSerializer()
-
-        # We have to pack the header into a buffer first so that we can
-        # calculate the size
-        header_fser = FastSerializer()
-
-        header_fser.writeByte(0)
-        header_fser.writeInt16(len(self.columns))
-        map(lambda x: x.writeType(header_fser), self.columns)
-        map(lambda x: x.writeName(header_fser), self.columns)
-
-        table_fser.writeInt32(header_fser.size() - 4)
-        table_fser.writeRawBytes(header_fser.getRawBytes())
-
-        table_fser.writeInt32(len(self.tuples))
+        # Everything is written straight into the serializer's buffer. The
+        # table, header and row lengths are not known up front, so a zeroed
+        # placeholder is written for each and patched once the size is known.
+        fser = self.fser
+        wbuf = fser.wbuf
+        lengthStruct = fser.int32Struct
+
+        table_offset = len(wbuf)
+        wbuf.extend(lengthStruct.pack(0))
+
+        header_offset = len(wbuf)
+        wbuf.extend(lengthStruct.pack(0))
+        fser.writeByte(0)
+        fser.writeInt16(len(self.columns))
+        for column in self.columns:
+            column.writeType(fser)
+        for column in self.columns:
+            column.writeName(fser)
+        lengthStruct.pack_into(wbuf, header_offset,
+                               len(wbuf) - header_offset - 8)
+
+        writers = [fser.getWriter(column.type) for column in self.columns]
+        fser.writeInt32(len(self.tuples))
         for i in self.tuples:
-            row_fser = FastSerializer()
+            row_offset = len(wbuf)
+            wbuf.extend(lengthStruct.pack(0))
 
-            map(lambda x: row_fser.write(self.columns[x].type, i[x]),
-                xrange(len(i)))
+            for j in xrange(len(i)):
+                writers[j](i[j])
 
-            table_fser.writeInt32(row_fser.size())
-            table_fser.writeRawBytes(row_fser.getRawBytes())
+            lengthStruct.pack_into(wbuf, row_offset, len(wbuf) - row_offset - 4)
 
-        table_fser.prependLength()
-        self.fser.writeRawBytes(table_fser.getRawBytes())
+        lengthStruct.pack_into(wbuf, table_offset, len(wbuf) - table_offset - 4)
 
 
 class VoltException:
@@ -900,11 +990,8 @@ class VoltException:
         if self.type == self.VOLTEXCEPTION_NONE:
             return
 
-        self.message = []
         self.message_len = fser.readInt32()
-        for i in xrange(0, self.message_len):
-            self.message.append(chr(fser.readByte()))
-        self.message = ''.join(self.message)
+        self.message = fser.readRaw(self.message_len).decode("utf-8", "replace")
 
         if self.type == self.VOLTEXCEPTION_GENERIC:
             self.typestr = "Generic"
@@ -914,10 +1001,7 @@ class VoltException:
             self.error_code = fser.readInt32()
         elif self.type == self.VOLTEXCEPTION_SQLEXCEPTION or \
                 self.type == self.VOLTEXCEPTION_CONSTRAINTFAILURE:
-            self.sql_state_bytes = []
-            for i in xrange(0, 5):
-                self.sql_state_bytes.append(chr(fser.readByte()))
-            self.sql_state_bytes = ''.join(self.sql_state_bytes)
+            self.sql_state_bytes = fser.readRaw(5)
 
             if self.type == self.VOLTEXCEPTION_SQLEXCEPTION:
                 self.typestr = "SQL Exception"
@@ -926,12 +1010,9 @@ class VoltException:
                 self.constraint_type = fser.readInt32()
                 self.table_name = fser.readString()
                 self.buffer_size = fser.readInt32()
-                self.buffer = []
-                for i in xrange(0, self.buffer_size):
-                    self.buffer.append(fser.readByte())
+                self.buffer = fser.readRaw(self.buffer_size)
         else:
-            for i in xrange(0, self.length - 3 - 2 - self.message_len):
-                fser.readByte()
+            fser.readRaw(self.length - 3 - 2 - self.message_len)
             print "Python client deserialized unknown VoltException."
 
     def __str__(self):
@@ -1010,27 +1091,31 @@ class VoltResponse:
 
 class VoltProcedure:
     "VoltDB called procedure interface"
+
+    # parameter values of these types are sent as arrays
+    ARRAY_TYPES = (list, tuple, array.array)
+
     def __init__(self, fser, name, paramtypes = []):
         self.fser = fser             # FastSerializer object
         self.name = name             # procedure class name
         self.paramtypes = paramtypes # list of fser.WIRE_* values
 
     def call(self, params = None, response = True, timeout = None):
-        self.fser.writeByte(0)  # version number
-        self.fser.writeString(self.name)
-        self.fser.writeInt64(1)            # client handle
-        self.fser.writeInt16(len(self.paramtypes))
+        # version number, procedure name, client handle and parameter count
+        name = self.name.encode("utf-8")
+        wbuf = self.fser.wbuf
+        wbuf.extend(self.fser.versionAndLengthStruct.pack(0, len(name)))
+        wbuf.extend(name)
+        wbuf.extend(self.fser.handleAndCountStruct.pack(1, len(self.paramtypes)))
         for i in xrange(len(self.paramtypes)):
-            try:
-                iter(params[i]) # Test if this is an array
-                if isinstance(params[i], basestring): # String is a special case
-                    raise TypeError
-
+            param = params[i]
+            type = self.paramtypes[i]
+            if isinstance(param, self.ARRAY_TYPES):
                 self.fser.writeByte(FastSerializer.ARRAY)
-                self.fser.writeByte(self.paramtypes[i])
-                self.fser.writeArray(self.paramtypes[i], params[i])
-            except TypeError:
-                self.fser.writeWireType(self.paramtypes[i], params[i])
+                self.fser.writeByte(type)
+                self.fser.writeArray(type, param)
+            else:
+                self.fser.writeWireType(type, param)
         self.fser.prependLength() # prepend the total length of the invocation
         self.fser.flush()
 
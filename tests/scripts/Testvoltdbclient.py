@@ -172,6 +172,20 @@ class TestFastSerializer(unittest.TestCase):
         for i in self.stringArray:
             self.sendAndCompare(self.fs.VOLTTYPE_STRING, i)
 
+    def testTruncatedString(self):
+        type = self.fs.VOLTTYPE_STRING
+
+        self.fs.writeWireType(type, self.stringArray[1])
+        self.fs.prependLength()
+        self.fs.flush()
+
+        self.fs.bufferForRead()
+        self.assertEqual(self.fs.readByte(), type)
+        # claim one more byte than the message holds
+        length = self.fs.readInt32()
+        self.assertRaises(VoltProtocolError, self.fs.readStringContent,
+                          length + 1)
+
     def testDate(self):
         for i in self.dateArray:
             self.sendAndCompare(self.fs.VOLTTYPE_TIMESTAMP, i)
@@ -234,6 +248,45 @@ class TestFastSerializer(unittest.TestCase):
         result.readFromSerializer()
         self.assertEqual(result, table)
 
+    def testNumericTable(self):
+        # A table of only fixed size numeric columns is decoded a row at a time
+        type = FastSerializer.VOLTTYPE_VOLTTABLE
+
+        table = VoltTable(self.fs)
+        table.columns.append(VoltColumn(type = FastSerializer.VOLTTYPE_TINYINT,
+                                        name = "tiny"))
+        table.columns.append(VoltColumn(type = FastSerializer.VOLTTYPE_SMALLINT,
+                                        name = "small"))
+        table.columns.append(VoltColumn(type = FastSerializer.VOLTTYPE_INTEGER,
+                                        name = "int"))
+        table.columns.append(VoltColumn(type = FastSerializer.VOLTTYPE_BIGINT,
+                                        name = "big"))
+        table.columns.append(VoltColumn(type = FastSerializer.VOLTTYPE_FLOAT,
+                                        name = "float"))
+        table.tuples.append([self.byteArray[1], self.int16Array[1],
+                             self.int32Array[1], self.int64Array[1],
+                             self.floatArray[3]])
+        table.tuples.append([self.byteArray[0], self.int16Array[0],
+                             self.int32Array[0], self.int64Array[0],
+                             self.floatArray[0]])
+        table.tuples.append([self.byteArray[3], self.int16Array[3],
+                             self.int32Array[3], self.int64Array[3],
+                             FastSerializer.NULL_FLOAT_INDICATOR * 0.95])
+
+        self.fs.writeByte(type)
+        table.writeToSerializer()
+        self.fs.prependLength()
+        self.fs.flush()
+
+        self.fs.bufferForRead()
+        self.assertEqual(self.fs.readByte(), type)
+        result = VoltTable(self.fs)
+        result.readFromSerializer()
+        self.assertEqual(result.columns, table.columns)
+        # a FLOAT close to the NULL indicator is read back as NULL
+        self.assertEqual(result.tuples, table.tuples[:2] +
+                         [table.tuples[2][:4] + [None]])
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         sys.exit(-1)